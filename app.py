@@ -2,16 +2,21 @@
 """
 DoseMate Syringe Pump - Flask Backend (Raspberry Pi 5)
 - Serves the UI (dosemate_pump1.html or dosemate_pump1 (2).html)
-- WiFi scan/connect via nmcli
+- WiFi scan/connect via NetworkManager D-Bus (nmcli fallback)
 - TB6600 + NEMA17 control on BCM: STEP=23, DIR=24, EN=25
+- STEP pulses timed outside Python: pigpio DMA waveforms (pigpiod) or
+  lgpio's C pulse thread (Pi 5); software loop with direct GPIO register
+  writes (or RPi.GPIO) as the last resort
 - Start / Pause / Resume / Cancel / Reset (retract)
 - Records save/load
 - Email export via Gmail SMTP (enter your 16-digit app password)
 """
 
-from flask import Flask, jsonify, request
-import subprocess, json, os, threading, time, csv, tempfile, smtplib
+from flask import Flask, Response, jsonify, request
+import subprocess, json, os, threading, time, gc, csv, tempfile, smtplib, atexit, re, bisect, ctypes, mmap, gzip, hashlib, uuid
 from datetime import datetime
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 
 app = Flask(__name__)
@@ -30,6 +35,13 @@ SENDER_PASSWORD = "sf**********nl"   # <<< REPLACE ONLY inside the quotes
 SMTP_HOST       = "smtp.gmail.com"
 SMTP_PORT       = 587
 USE_TLS         = True
+# Gmail's 25 MB limit applies to the encoded message and base64 grows the
+# file by 4/3, so cap the raw attachment at ~3/4 of that minus headroom
+MAX_ATTACHMENT_BYTES = 18 * 1024 * 1024
+
+# One logged-in SMTP session, reused across sends (TLS + AUTH is the slow part)
+_smtp_singleton = None
+_smtp_lock = threading.Lock()
 
 # --- GPIO / TB6600 ---
 try:
@@ -38,6 +50,31 @@ try:
 except ImportError:
     HARDWARE_AVAILABLE = False
 
+# --- pigpio (optional): DMA-timed STEP waveforms via the pigpiod daemon ---
+# Start the daemon with:  sudo pigpiod
+# If pigpio is missing or the daemon is not running we try lgpio next.
+try:
+    import pigpio
+    PIGPIO_AVAILABLE = True
+except ImportError:
+    PIGPIO_AVAILABLE = False
+
+# --- lgpio (optional): STEP pulses from lgpio's C thread, GIL released ---
+# This is the native GPIO library on Pi 5 (pigpio does not support the RP1).
+# Without either library we fall back to toggling STEP from Python.
+try:
+    import lgpio
+    LGPIO_AVAILABLE = True
+except ImportError:
+    LGPIO_AVAILABLE = False
+
+pi = None                # pigpio connection, opened once in _gpio_setup
+lg = None                # lgpio gpiochip handle (owns STEP_PIN), opened once in _gpio_setup
+step_regs = None         # (set, clear) GPIO registers for the software STEP loop
+_backend_picked = False  # pi/lg already tried by _gpio_setup
+WAVE_CHUNK_STEPS = 1000  # max steps per chunk (stays inside pigpio's wave buffer)
+WAVE_POLL_S      = 0.05  # pause/cancel checks while a chunk is playing (~20 Hz)
+
 STEP_PIN = 23  # BCM
 DIR_PIN  = 24
 EN_PIN   = 25
@@ -57,31 +94,132 @@ BASE_SYRINGE_STEPS_PER_ML = {10: 303, 15: 265, 20: 168}
 # From 5 mL → 2 mL result: factor ≈ 5/2 = 2.5
 CALIBRATION_FACTOR = 2.5
 
+# Calibrated table, folded once at import (restart after changing the values above)
+SYRINGE_STEPS_PER_ML = {k: v * CALIBRATION_FACTOR for k, v in BASE_SYRINGE_STEPS_PER_ML.items()}
+
 def get_steps_per_ml(syringe_size: int) -> float:
-    base = BASE_SYRINGE_STEPS_PER_ML.get(int(syringe_size), BASE_SYRINGE_STEPS_PER_ML[10])
-    return base * CALIBRATION_FACTOR
+    return SYRINGE_STEPS_PER_ML.get(syringe_size, SYRINGE_STEPS_PER_ML[10])
+
+# Live infusion status is an immutable snapshot in a one-element list.
+# Routes swap in a new tuple under infusion_state["lock"] (see _publish), the
+# pulse loop without it (see _publish_steps); readers just take
+# infusion_state_ref[0] - a single reference load, no lock.
+# progress_pct/eta_* are precomputed by the writers, so /api/infusion_status
+# only serializes the tuple.
+_Snapshot = namedtuple('Snapshot', 'running paused cancelled total_steps steps_done '
+                                   'steps_per_sec syringe_size volume_ml flow_rate_ml_hr '
+                                   'progress_pct eta_h eta_m eta_s')
+infusion_state_ref = [_Snapshot(False, False, False, 0, 0, 0.0, 10, 0.0, 0.0, 0.0, 0, 0, 0)]
 
 infusion_state = {
-    "running": False,
-    "paused": False,
-    "cancelled": False,
-    "total_steps": 0,
-    "steps_done": 0,
-    "steps_per_sec": 0.0,
-    "syringe_size": 10,
-    "volume_ml": 0.0,
-    "flow_rate_ml_hr": 0.0,
     "thread": None,
     "lock": threading.Lock(),
 }
+# Control flags for the running infusion. _resume_evt is set while the pump
+# may run and cleared to pause, so the worker blocks in _resume_evt.wait()
+# with no polling and wakes the moment it is set again.
+_resume_evt = threading.Event()
+_resume_evt.set()
+_cancel_evt = threading.Event()
 delivered_steps_history = 0  # for reset/retract
 
+def _publish(**changes):
+    with infusion_state["lock"]:
+        infusion_state_ref[0] = infusion_state_ref[0]._replace(**changes)
+
+def _progress(steps_done, total_steps, sps):
+    progress = (steps_done/total_steps*100.0) if total_steps>0 else 0.0
+    rem = max(total_steps - steps_done, 0)
+    eta = (rem/sps) if sps>0 else 0
+    return {
+        "progress_pct": progress,
+        "eta_h": int(eta//3600),
+        "eta_m": int((eta%3600)//60),
+        "eta_s": int(eta%60),
+    }
+
+def _publish_steps(steps_done):
+    """
+    Progress update from the pulse loop, lock-free. The worker is the only
+    writer of steps_done; the flags are re-derived from the events rather
+    than copied from the old tuple, so a racing pause/cancel route is not
+    undone (at worst it is stale until the next update).
+    """
+    cancelled = _cancel_evt.is_set()
+    snap = infusion_state_ref[0]
+    infusion_state_ref[0] = snap._replace(
+        steps_done=steps_done, running=not cancelled, cancelled=cancelled,
+        paused=not _resume_evt.is_set(),
+        **_progress(steps_done, snap.total_steps, snap.steps_per_sec))
+
+def _lgpio_open():
+    """
+    Open the SoC's pinctrl gpiochip (gpiochip0 on current Pi 5 kernels,
+    gpiochip4 on older ones) and claim STEP_PIN. Returns the handle or None.
+    """
+    for chip in (0, 4):
+        try:
+            h = lgpio.gpiochip_open(chip)
+        except lgpio.error:
+            continue
+        try:
+            if lgpio.gpio_get_chip_info(h)[3].startswith("pinctrl-"):
+                lgpio.gpio_claim_output(h, STEP_PIN, 0)
+                return h
+        except lgpio.error:
+            pass
+        lgpio.gpiochip_close(h)
+    return None
+
+def _gpio_mmio_open():
+    """
+    Map the GPIO block and return (set, clear) 32-bit registers so the
+    software loop can toggle STEP with one store instead of a library call.
+    Pi 5 (BCM2712): RP1 RIO bank 0 in /dev/gpiomem0, SET/CLR aliases at
+    +0x2000/+0x3000. Earlier Pis: GPSET0/GPCLR0 at 0x1C/0x28 in /dev/gpiomem.
+    Returns None if the device cannot be mapped.
+    """
+    try:
+        with open("/proc/device-tree/compatible", "rb") as f:
+            pi5 = b"brcm,bcm2712" in f.read()
+    except OSError:
+        pi5 = False
+    dev, size, set_off, clr_off = (
+        ("/dev/gpiomem0", 0x14000, 0x12000, 0x13000) if pi5 else
+        ("/dev/gpiomem",  0x1000,  0x1C,    0x28)
+    )
+    try:
+        fd = os.open(dev, os.O_RDWR | os.O_SYNC)
+        try:
+            mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+    return ctypes.c_uint32.from_buffer(mm, set_off), ctypes.c_uint32.from_buffer(mm, clr_off)
+
 def _gpio_setup():
+    global pi, lg, step_regs, _backend_picked
     if not HARDWARE_AVAILABLE:
         return
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
-    GPIO.setup(STEP_PIN, GPIO.OUT, initial=GPIO.LOW)
+    # Pick the STEP backend once: pigpiod, then lgpio, else RPi.GPIO.
+    # A failed pigpiod connection is not retried on every start.
+    if not _backend_picked:
+        if PIGPIO_AVAILABLE:
+            conn = pigpio.pi()
+            if conn.connected:
+                pi = conn
+            else:
+                conn.stop()
+        if LGPIO_AVAILABLE and pi is None:
+            lg = _lgpio_open()
+        _backend_picked = True
+    if lg is None:
+        GPIO.setup(STEP_PIN, GPIO.OUT, initial=GPIO.LOW)
+        if pi is None and step_regs is None:
+            step_regs = _gpio_mmio_open()
     GPIO.setup(DIR_PIN,  GPIO.OUT, initial=GPIO.LOW)
     GPIO.setup(EN_PIN,   GPIO.OUT, initial=GPIO.HIGH)  # disabled
     # Enable driver (invert if your TB6600 wants HIGH to enable)
@@ -96,52 +234,184 @@ def _gpio_disable():
         pass
 
 def _gpio_cleanup():
+    global pi, lg
     if not HARDWARE_AVAILABLE:
         return
     _gpio_disable()
+    if pi is not None:
+        pi.stop()
+        pi = None
+    if lg is not None:
+        lgpio.gpiochip_close(lg)
+        lg = None
     GPIO.cleanup()
 
-def _pulse_steps(step_count, direction, steps_per_sec, pause_flag_getter, cancel_flag_getter):
+# Real-time scheduling for the thread that pulses STEP (best effort, needs root).
+# For a dedicated core also add  isolcpus=3  to /boot/firmware/cmdline.txt.
+PULSE_CPU     = 3
+PULSE_RT_PRIO = 50
+
+def _make_realtime():
+    """
+    Pin the calling thread to PULSE_CPU and switch it to SCHED_FIFO so
+    other processes cannot preempt the pulse loop. Flask threads share the
+    GIL with it, so the software loop can still be held up to
+    sys.getswitchinterval() (5 ms) waiting for the GIL; the pigpio/lgpio
+    paths time STEP outside Python and are unaffected.
+    On Linux, pid 0 means the calling thread only; skipped without root.
+    """
+    if not HARDWARE_AVAILABLE:
+        return
+    try:
+        os.sched_setaffinity(0, {PULSE_CPU})
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(PULSE_RT_PRIO))
+    except (AttributeError, OSError):
+        pass
+
+def _tx_busy():
+    if pi is not None:
+        return pi.wave_tx_busy()
+    return lgpio.tx_busy(lg, STEP_PIN, lgpio.TX_PWM)
+
+def _tx_stop():
+    # Stopping mid-pulse can leave STEP high; drive it low so the next
+    # chunk's first rising edge is a real step
+    if pi is not None:
+        pi.wave_tx_stop()
+        pi.write(STEP_PIN, 0)
+    else:
+        lgpio.tx_pulse(lg, STEP_PIN, 0, 0)
+        lgpio.gpio_write(lg, STEP_PIN, 0)
+
+def _pulse_steps_tx(step_count, steps_per_sec, resume_evt, cancel_evt, report):
+    """
+    pigpio/lgpio path of _pulse_steps: the STEP train is timed by the DMA
+    engine (pigpio) or lgpio's C thread, so Python only checks pause/cancel
+    at ~20 Hz while chunks play and stops the chunk when either is set.
+    Chunks are ~1 s long (max WAVE_CHUNK_STEPS) so pause reacts quickly
+    even at high step rates.
+    """
+    half_us = max(int(round(5e5 / steps_per_sec)), 1)
+    mask = 1 << STEP_PIN
+    chunk = min(WAVE_CHUNK_STEPS, max(int(steps_per_sec), 1))
+
+    sent = 0
+    while sent < step_count:
+        if not resume_evt.is_set():
+            report(sent)  # publish the paused state before blocking
+            resume_evt.wait()
+        if cancel_evt.is_set():
+            break
+        n = min(chunk, step_count - sent)
+        wid = None
+        if pi is not None:
+            pi.wave_clear()
+            pi.wave_add_generic([pigpio.pulse(mask, 0, half_us), pigpio.pulse(0, mask, half_us)] * n)
+            wid = pi.wave_create()
+            pi.wave_send_once(wid)
+        else:
+            lgpio.tx_pulse(lg, STEP_PIN, half_us, half_us, 0, n)
+        t0 = time.monotonic()
+        while _tx_busy():
+            if cancel_evt.wait(WAVE_POLL_S) or not resume_evt.is_set():
+                # Stop the chunk; a pause then waits at the top of the loop
+                # and resends only the steps that did not play
+                _tx_stop()
+                # Rising edges start each period, so count the one in flight
+                n = min(int((time.monotonic() - t0) * steps_per_sec) + 1, n)
+                break
+            report(sent + min(int((time.monotonic() - t0) * steps_per_sec), n))
+        if wid is not None:
+            pi.wave_delete(wid)
+        sent += n
+        report(sent)
+    return sent
+
+def _pulse_steps(step_count, direction, steps_per_sec, infusion=False):
     """
     Send 'step_count' pulses at 'steps_per_sec' in 'direction'.
     Works both for steps_per_sec < 1 and > 1.
+    With infusion=True, honours _resume_evt/_cancel_evt and publishes
+    progress to the status snapshot. Returns the number of steps sent.
     """
     if steps_per_sec <= 0:
         steps_per_sec = 0.0001  # avoid divide-by-zero, extremely slow
+    if infusion:
+        resume_evt, cancel_evt, report = _resume_evt, _cancel_evt, _publish_steps
+    else:
+        resume_evt, cancel_evt, report = threading.Event(), threading.Event(), lambda n: None
+        resume_evt.set()
 
-    # Simulate if not on Pi
-    if not HARDWARE_AVAILABLE:
-        delay = 1.0 / (steps_per_sec * 2.0)
-        for _ in range(step_count):
-            while pause_flag_getter():
-                time.sleep(0.05)
-            if cancel_flag_getter():
-                break
-            time.sleep(delay * 2)
-        return
+    # Publish progress every (check_mask + 1) steps: every step at infusion
+    # rates, up to every 32 steps at high rates (still >= ~20 updates/s).
+    check_mask = (1 << min(max(int(steps_per_sec / 20), 1).bit_length() - 1, 5)) - 1
+
+    if HARDWARE_AVAILABLE:
+        GPIO.output(DIR_PIN, GPIO.HIGH if direction == "forward" else GPIO.LOW)
+        if pi is not None or lg is not None:
+            return _pulse_steps_tx(step_count, steps_per_sec, resume_evt, cancel_evt, report)
 
-    GPIO.output(DIR_PIN, GPIO.HIGH if direction == "forward" else GPIO.LOW)
-    delay = 1.0 / (steps_per_sec * 2.0)  # HIGH then LOW → full step period
+    # Software timing (also simulates when not on a Pi). Each edge sleeps to
+    # an absolute deadline t0 + i*period, so sleep overshoot does not add up
+    # step after step. The sleeps wait on cancel_evt so a cancel cuts them
+    # short instead of letting one more pulse out.
+    period_ns = int(1e9 / steps_per_sec)
+    half_ns   = period_ns // 2  # HIGH for half the period, then LOW
+    # Direct register stores when the GPIO block is mapped, else RPi.GPIO
+    gpset, gpclr = step_regs or (None, None)
+    bit = 1 << STEP_PIN
+    # Bind hot-loop globals/attributes to locals once per call
+    monotonic_ns, hw = time.monotonic_ns, HARDWARE_AVAILABLE
+    wait, running, cancelled = cancel_evt.wait, resume_evt.is_set, cancel_evt.is_set
+    t0 = monotonic_ns()
 
-    for _ in range(step_count):
-        while pause_flag_getter():
-            time.sleep(0.05)
-        if cancel_flag_getter():
+    sent = 0
+    for i in range(step_count):
+        rise = t0 + i * period_ns
+        delta = rise - monotonic_ns()
+        if delta > 0:
+            wait(delta / 1e9)
+        elif delta < -period_ns:
+            t0 -= delta  # stalled over a whole step: re-anchor rather than burst
+            rise -= delta
+        # Re-check right before the edge: a pause/cancel may have arrived
+        # during the wait above
+        if not running():
+            report(sent)  # publish the paused state before blocking
+            resume_evt.wait()  # paused: block until resume (or cancel)
+            t0 = monotonic_ns() - i * period_ns  # resume from now, no catch-up burst
+            rise = t0 + i * period_ns
+        if cancelled():
             break
-        GPIO.output(STEP_PIN, GPIO.HIGH)
-        time.sleep(delay)
-        GPIO.output(STEP_PIN, GPIO.LOW)
-        time.sleep(delay)
+        if gpset is not None:
+            gpset.value = bit
+        elif hw:
+            GPIO.output(STEP_PIN, GPIO.HIGH)
+        delta = rise + half_ns - monotonic_ns()
+        if delta > 0:
+            wait(delta / 1e9)  # the rising edge already stepped; just end the pulse early
+        if gpclr is not None:
+            gpclr.value = bit
+        elif hw:
+            GPIO.output(STEP_PIN, GPIO.LOW)
+        sent += 1
+        if (i & check_mask) == 0:
+            report(sent)
+    report(sent)
+    return sent
 
 def infusion_worker(flow_rate_ml_hr, volume_ml, syringe_size):
     """
     Main infusion loop: computes total steps & step rate from
-    volume and ml/hr, then pulses the driver.
+    volume and ml/hr, then pulses the driver in one batched call.
     """
     global delivered_steps_history
 
     # Use calibrated steps/mL
-    steps_per_ml = get_steps_per_ml(syringe_size)
+    steps_per_ml = get_steps_per_ml(int(syringe_size))
     total_steps  = max(int(round(volume_ml * steps_per_ml)), 0)
 
     # ml/hr → ml/s
@@ -151,50 +421,37 @@ def infusion_worker(flow_rate_ml_hr, volume_ml, syringe_size):
     if steps_per_sec <= 0:
         steps_per_sec = 0.0001
 
-    with infusion_state["lock"]:
-        infusion_state.update({
-            "running": True,
-            "paused": False,
-            "cancelled": False,
-            "total_steps": total_steps,
-            "steps_done": 0,
-            "steps_per_sec": steps_per_sec,
-            "syringe_size": syringe_size,
-            "volume_ml": volume_ml,
-            "flow_rate_ml_hr": flow_rate_ml_hr,
-        })
+    # running/paused/cancelled were already reset by api_start_infusion
+    _publish(
+        total_steps=total_steps,
+        steps_done=0,
+        steps_per_sec=steps_per_sec,
+        syringe_size=syringe_size,
+        volume_ml=volume_ml,
+        flow_rate_ml_hr=flow_rate_ml_hr,
+        **_progress(0, total_steps, steps_per_sec),
+    )
 
     steps_sent = 0
-
-    for _ in range(total_steps):
-        with infusion_state["lock"]:
-            if infusion_state["cancelled"]:
-                break
-
-        _pulse_steps(
-            1,
-            "forward",
-            steps_per_sec,
-            pause_flag_getter=lambda: infusion_state["paused"],
-            cancel_flag_getter=lambda: infusion_state["cancelled"],
-        )
-
-        steps_sent += 1
-        with infusion_state["lock"]:
-            infusion_state["steps_done"] = steps_sent
-
+    try:
+        _make_realtime()
+        steps_sent = _pulse_steps(total_steps, "forward", steps_per_sec, infusion=True)
+    finally:
+        # Finish - also when pigpio/lgpio raise, so the pump is never left
+        # reported as running with the driver enabled
+        # Set the counters explicitly: a route's _publish racing the
+        # lock-free progress updates may have put back a stale steps_done.
+        # The event and the tuple change together under the lock, so a
+        # pause arriving now cannot leave the finished pump "paused".
         with infusion_state["lock"]:
-            if infusion_state["cancelled"]:
-                break
-
-    # Finish
-    with infusion_state["lock"]:
-        infusion_state["running"] = False
-        infusion_state["paused"]  = False
+            _resume_evt.set()
+            infusion_state_ref[0] = infusion_state_ref[0]._replace(
+                running=False, paused=False, steps_done=steps_sent,
+                **_progress(steps_sent, total_steps, steps_per_sec))
 
-    delivered_steps_history = steps_sent
-    if steps_sent == 0:
-        _gpio_disable()
+        delivered_steps_history = steps_sent
+        if steps_sent == 0:
+            _gpio_disable()
 
 def retract_worker():
     """
@@ -211,15 +468,12 @@ def retract_worker():
     # Use a reasonable retract speed (e.g. 400 steps/sec)
     retract_sps = 400.0
 
-    _pulse_steps(
-        steps_to_retract,
-        "reverse",
-        retract_sps,
-        pause_flag_getter=lambda: False,
-        cancel_flag_getter=lambda: False,
-    )
-    delivered_steps_history = 0
-    _gpio_disable()
+    try:
+        _make_realtime()
+        _pulse_steps(steps_to_retract, "reverse", retract_sps)
+        delivered_steps_history = 0
+    finally:
+        _gpio_disable()
 
 # ---- WiFi helpers (nmcli) ----
 def _run(cmd, timeout=15):
@@ -231,37 +485,212 @@ def _run(cmd, timeout=15):
     except Exception as e:
         return 1, "", str(e)
 
+# Scan results stay valid for a few seconds; reuse them instead of asking NetworkManager again
+_WIFI_TTL = 5.0
+_WIFI_CACHE = {"t": -_WIFI_TTL, "data": []}
+_wifi_lock = threading.Lock()
+
 def scan_wifi_networks():
-    networks = []
-    code, out, err = _run(['nmcli','-t','-f','SSID,SECURITY,SIGNAL','dev','wifi'], timeout=10)
+    if time.monotonic() - _WIFI_CACHE["t"] < _WIFI_TTL:
+        return _WIFI_CACHE["data"]
+    with _wifi_lock:
+        # Another request may have refreshed the cache while we waited
+        if time.monotonic() - _WIFI_CACHE["t"] < _WIFI_TTL:
+            return _WIFI_CACHE["data"]
+        res = _scan_wifi_dbus()                # NetworkManager's list, rescanned if stale
+        if res is None:
+            res = _scan_wifi_nmcli('auto')     # same via nmcli
+        if not res:
+            res = _scan_wifi_nmcli('yes')  # nothing cached yet: full scan
+        _WIFI_CACHE["data"] = res
+        _WIFI_CACHE["t"] = time.monotonic()
+        return res
+
+# nmcli -t line: SSID:SECURITY:SIGNAL (SSID itself may contain ':')
+_WIFI_RE = re.compile(r'^(?P<ssid>.*):(?P<sec>[^:]*):(?P<sig>\d+)$')
+_LABELS = ('Weak', 'Fair', 'Good', 'Excellent')
+_THRESH = (40, 60, 80)
+
+def _scan_wifi_nmcli(rescan):
+    found, seen = [], set()
+    code, out, err = _run(['nmcli','-t','-f','SSID,SECURITY,SIGNAL','dev','wifi','list','--rescan',rescan], timeout=10)
     if code == 0 and out:
         for line in out.splitlines():
-            parts = line.split(':')
-            if len(parts) >= 3:
-                ssid = ':'.join(parts[:-2]) or 'Hidden Network'
-                security = parts[-2] or ''
-                strength = parts[-1] or '0'
-                if not security or security == '--':
-                    security = 'Open'
-                try:
-                    sig = int(strength)
-                except Exception:
-                    sig = 0
-                label = 'Excellent' if sig>=80 else 'Good' if sig>=60 else 'Fair' if sig>=40 else 'Weak'
-                networks.append({'ssid': ssid, 'signal': label, 'security': security, 'strength': f'{sig}%'})
-    # dedupe + sort
-    seen, res = set(), []
-    for n in networks:
-        if n['ssid'] in seen:
+            m = _WIFI_RE.match(line)
+            if not m:
+                continue
+            ssid = m['ssid'] or 'Hidden Network'
+            if ssid in seen:
+                continue
+            seen.add(ssid)
+            security = m['sec']
+            if not security or security == '--':
+                security = 'Open'
+            sig = int(m['sig'])
+            label = _LABELS[bisect.bisect_right(_THRESH, sig)]
+            found.append((sig, {'ssid': ssid, 'signal': label, 'security': security, 'strength': f'{sig}%'}))
+    found.sort(key=lambda f: f[0], reverse=True)
+    return [n for _, n in found]
+
+# ---- WiFi helpers (NetworkManager over D-Bus) ----
+# python3-dbus (preinstalled on Raspberry Pi OS) lets us talk to NetworkManager
+# in-process instead of forking nmcli for every query. If it is missing or
+# NetworkManager is unreachable, the nmcli helpers above are used instead.
+try:
+    import dbus
+    DBUS_AVAILABLE = True
+except ImportError:
+    DBUS_AVAILABLE = False
+
+NM_BUS   = 'org.freedesktop.NetworkManager'
+NM_PATH  = '/org/freedesktop/NetworkManager'
+NM_PROPS = 'org.freedesktop.DBus.Properties'
+NM_DEVICE_TYPE_WIFI   = 2
+NM_ACTIVE_ACTIVATED   = 2
+NM_ACTIVE_DEACTIVATED = 4
+# NM80211ApFlags / NM80211ApSecurityFlags bits used for the security label
+NM_AP_PRIVACY      = 0x1
+NM_KEY_MGMT_PSK    = 0x100
+NM_KEY_MGMT_8021X  = 0x200
+NM_KEY_MGMT_SAE    = 0x400
+# Rescan when NetworkManager's results are older than this (nmcli's
+# '--rescan auto' rule); a connected device may go long between scans
+NM_RESCAN_AGE_MS   = 30000
+NM_RESCAN_WAIT_S   = 10
+
+def _nm_wifi_device():
+    """Return (bus, NetworkManager iface, WiFi device path), or None if D-Bus is unusable."""
+    if not DBUS_AVAILABLE:
+        return None
+    try:
+        bus = dbus.SystemBus()
+        nm = dbus.Interface(bus.get_object(NM_BUS, NM_PATH), NM_BUS)
+        for path in nm.GetDevices():
+            props = dbus.Interface(bus.get_object(NM_BUS, path), NM_PROPS)
+            if props.Get(NM_BUS + '.Device', 'DeviceType') == NM_DEVICE_TYPE_WIFI:
+                return bus, nm, path
+    except dbus.DBusException:
+        pass
+    return None
+
+def _ap_security(ap):
+    # Same labels nmcli prints in its SECURITY column
+    flags, wpa, rsn = ap['Flags'], ap['WpaFlags'], ap['RsnFlags']
+    parts = []
+    if flags & NM_AP_PRIVACY and not wpa and not rsn:
+        parts.append('WEP')
+    if wpa:
+        parts.append('WPA1')
+    if rsn & (NM_KEY_MGMT_PSK | NM_KEY_MGMT_8021X):
+        parts.append('WPA2')
+    if rsn & NM_KEY_MGMT_SAE:
+        parts.append('WPA3')
+    if (wpa | rsn) & NM_KEY_MGMT_8021X:
+        parts.append('802.1X')
+    return ' '.join(parts) or 'Open'
+
+def _nm_rescan_if_stale(wifi, props):
+    """Ask for a new scan and wait for it if the last one is too old."""
+    # LastScan is in CLOCK_BOOTTIME milliseconds, -1 if never scanned
+    last = props.Get(NM_BUS + '.Device.Wireless', 'LastScan')
+    if last >= 0 and time.clock_gettime(time.CLOCK_BOOTTIME) * 1000 - last < NM_RESCAN_AGE_MS:
+        return
+    try:
+        wifi.RequestScan({})
+    except dbus.DBusException:
+        return  # not allowed right now (e.g. scan in progress): use what we have
+    deadline = time.monotonic() + NM_RESCAN_WAIT_S
+    while time.monotonic() < deadline:
+        time.sleep(0.25)
+        if props.Get(NM_BUS + '.Device.Wireless', 'LastScan') != last:
+            break
+
+def _scan_wifi_dbus():
+    """NetworkManager's current access point list, or None if D-Bus is unusable."""
+    nmdev = _nm_wifi_device()
+    if nmdev is None:
+        return None
+    bus, nm, dev_path = nmdev
+    found = []
+    try:
+        wifi = dbus.Interface(bus.get_object(NM_BUS, dev_path), NM_BUS + '.Device.Wireless')
+        _nm_rescan_if_stale(wifi, dbus.Interface(bus.get_object(NM_BUS, dev_path), NM_PROPS))
+        for ap_path in wifi.GetAllAccessPoints():
+            ap = dbus.Interface(bus.get_object(NM_BUS, ap_path), NM_PROPS).GetAll(NM_BUS + '.AccessPoint')
+            ssid = bytes(ap['Ssid']).decode('utf-8', 'replace') or 'Hidden Network'
+            found.append((int(ap['Strength']), ssid, _ap_security(ap)))
+    except dbus.DBusException:
+        return None
+    # Strongest first, so the dedupe keeps each SSID's best AP
+    found.sort(key=lambda f: f[0], reverse=True)
+    res, seen = [], set()
+    for sig, ssid, security in found:
+        if ssid in seen:
             continue
-        seen.add(n['ssid'])
-        res.append(n)
-    res.sort(key=lambda n: int(n['strength'].rstrip('%') or 0), reverse=True)
+        seen.add(ssid)
+        label = _LABELS[bisect.bisect_right(_THRESH, sig)]
+        res.append({'ssid': ssid, 'signal': label, 'security': security, 'strength': f'{sig}%'})
     return res
 
+def _connect_wifi_dbus(ssid, password, security, timeout=30):
+    """
+    Replace any profile named 'ssid' and create + activate a new one with a
+    single AddAndActivateConnection call, then wait for it to come up.
+    Returns (ok, message), or None to let the caller fall back to nmcli.
+    """
+    sec = (security or '').upper()
+    open_net = sec.lower() in ['open','--','none','']
+    if not open_net and ('WEP' in sec or '802.1X' in sec):
+        return None  # leave these to nmcli
+    nmdev = _nm_wifi_device()
+    if nmdev is None:
+        return None
+    bus, nm, dev_path = nmdev
+
+    settings = {
+        'connection': {'id': ssid, 'type': '802-11-wireless'},
+        '802-11-wireless': {'ssid': dbus.ByteArray(ssid.encode('utf-8'))},
+    }
+    if not open_net:
+        settings['802-11-wireless-security'] = {
+            'key-mgmt': 'sae' if 'WPA3' in sec and 'WPA2' not in sec else 'wpa-psk',
+            'psk': password,
+        }
+    try:
+        nm_settings = dbus.Interface(bus.get_object(NM_BUS, NM_PATH + '/Settings'), NM_BUS + '.Settings')
+        for path in nm_settings.ListConnections():
+            con = dbus.Interface(bus.get_object(NM_BUS, path), NM_BUS + '.Settings.Connection')
+            if con.GetSettings()['connection']['id'] == ssid:
+                con.Delete()
+        con_path, active_path = nm.AddAndActivateConnection(settings, dev_path, '/')
+    except dbus.DBusException as e:
+        return False, (e.get_dbus_message() or "Failed to connect")
+
+    state = 0
+    active = dbus.Interface(bus.get_object(NM_BUS, active_path), NM_PROPS)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            state = active.Get(NM_BUS + '.Connection.Active', 'State')
+        except dbus.DBusException:
+            break  # NetworkManager drops the active object when activation fails
+        if state in (NM_ACTIVE_ACTIVATED, NM_ACTIVE_DEACTIVATED):
+            break
+        time.sleep(0.25)
+    if state == NM_ACTIVE_ACTIVATED:
+        return True, "Connected"
+    try:
+        dbus.Interface(bus.get_object(NM_BUS, con_path), NM_BUS + '.Settings.Connection').Delete()
+    except dbus.DBusException:
+        pass
+    return False, "Failed to connect"
+
 def connect_wifi(ssid, password="", security=""):
     if not ssid:
         return False, "SSID required"
+    res = _connect_wifi_dbus(ssid, password, security)
+    if res is not None:
+        return res
     # Open network?
     if (security or '').lower() in ['open','--','none','']:
         cmd = ['nmcli','dev','wifi','connect', ssid]
@@ -291,24 +720,81 @@ def connect_wifi(ssid, password="", security=""):
             return False, (e1 or o1 or "Profile add failed")
     return False, (err or out or "Failed to connect")
 
+# ---- Records (newline-delimited JSON: one record per line, append-only) ----
+RECORDS_FILE        = 'infusion_records.jsonl'
+LEGACY_RECORDS_FILE = 'infusion_records.json'   # old single-array format
+
+def _iter_records():
+    """
+    Yield records in file order. The file is mmap'ed, so lines come straight
+    from the page cache. A line that does not parse (e.g. cut short by a
+    power loss mid-append) is skipped instead of discarding every record.
+    """
+    try:
+        f = open(RECORDS_FILE, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+def _append_record(rec):
+    line = (json.dumps(rec, separators=(',', ':')) + '\n').encode('utf-8')
+    with open(RECORDS_FILE, 'a+b') as f:
+        # Start on a fresh line if the previous append was cut short
+        end = f.seek(0, os.SEEK_END)
+        if end:
+            f.seek(end - 1)
+            if f.read(1) != b'\n':
+                line = b'\n' + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _migrate_records_json():
+    """One-time conversion of infusion_records.json to JSONL (old file kept as .migrated)."""
+    if not os.path.exists(LEGACY_RECORDS_FILE) or os.path.exists(RECORDS_FILE):
+        return
+    try:
+        with open(LEGACY_RECORDS_FILE, 'r') as f:
+            records = json.load(f)
+    except Exception:
+        return
+    # Write a temp file and rename it over, so a crash never leaves a half-written JSONL
+    tmp = RECORDS_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        for rec in records:
+            f.write(json.dumps(rec, separators=(',', ':')) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, RECORDS_FILE)
+    os.replace(LEGACY_RECORDS_FILE, LEGACY_RECORDS_FILE + '.migrated')
+
 # ---- Export & Email ----
+def _export_tempfile(suffix):
+    # mkstemp, not just a timestamped name: two exports in the same second
+    # must not share (and delete) one file
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return tempfile.mkstemp(suffix=suffix, prefix=f'dosemate_records_{stamp}_')
+
 def export_records_csv():
-    records = []
-    if os.path.exists('infusion_records.json'):
-        try:
-            with open('infusion_records.json','r') as f:
-                records = json.load(f)
-        except Exception:
-            records = []
-    path = os.path.join(
-        tempfile.gettempdir(),
-        f'dosemate_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-    )
-    with open(path, 'w', newline='', encoding='utf-8') as csvfile:
-        if records:
-            fn = list(records[0].keys())
+    fd, path = _export_tempfile('.csv')
+    records = _iter_records()
+    first = next(records, None)
+    with os.fdopen(fd, 'w', newline='', encoding='utf-8') as csvfile:
+        if first is not None:
+            fn = list(first.keys())
             w = csv.DictWriter(csvfile, fieldnames=fn)
             w.writeheader()
+            w.writerow(first)
             w.writerows(records)
         else:
             csv.writer(csvfile).writerow(
@@ -317,20 +803,53 @@ def export_records_csv():
     return path
 
 def export_records_json():
-    records = []
-    if os.path.exists('infusion_records.json'):
+    fd, path = _export_tempfile('.json')
+    # Same layout as json.dump(records, f, indent=2), written one record at a time
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        sep = '[\n  '
+        for rec in _iter_records():
+            f.write(sep + json.dumps(rec, indent=2).replace('\n', '\n  '))
+            sep = ',\n  '
+        f.write('[]' if sep == '[\n  ' else '\n]')
+    return path
+
+def _smtp_connect():
+    if USE_TLS:
+        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20)
+        s.starttls()
+    else:
+        s = smtplib.SMTP_SSL(SMTP_HOST, 465, timeout=20)
+    s.login(SENDER_EMAIL, SENDER_PASSWORD)
+    return s
+
+def _get_smtp():
+    """
+    Return the shared SMTP session, reconnecting if NOOP shows it is dead.
+    Caller must hold _smtp_lock.
+    """
+    global _smtp_singleton
+    if _smtp_singleton is not None:
+        try:
+            if _smtp_singleton.noop()[0] == 250:
+                return _smtp_singleton
+        except (smtplib.SMTPException, OSError):
+            pass
         try:
-            with open('infusion_records.json','r') as f:
-                records = json.load(f)
+            _smtp_singleton.close()
         except Exception:
-            records = []
-    path = os.path.join(
-        tempfile.gettempdir(),
-        f'dosemate_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-    )
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(records, f, indent=2)
-    return path
+            pass
+        _smtp_singleton = None
+    _smtp_singleton = _smtp_connect()
+    return _smtp_singleton
+
+def _smtp_quit():
+    if _smtp_singleton is not None:
+        try:
+            _smtp_singleton.quit()
+        except Exception:
+            pass
+
+atexit.register(_smtp_quit)
 
 def send_email_fixed(to_addr, attachments=None):
     if not to_addr:
@@ -354,34 +873,57 @@ def send_email_fixed(to_addr, attachments=None):
             mt, st = "application", "json"
         else:
             mt, st = "application","octet-stream"
+        # Check the size before reading so a huge export never sits in RAM
+        try:
+            size = os.path.getsize(p)
+        except OSError:
+            return False, f"{name} is missing"
+        if size > MAX_ATTACHMENT_BYTES:
+            return False, f"{name} is too large to email ({size // (1024*1024)} MB)"
         try:
             with open(p,'rb') as f:
                 msg.add_attachment(f.read(), maintype=mt, subtype=st, filename=name)
-        except Exception:
-            pass
+        except OSError as e:
+            return False, f"{name} could not be read: {e}"
     try:
-        if USE_TLS:
-            s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20)
-            s.starttls()
-        else:
-            s = smtplib.SMTP_SSL(SMTP_HOST, 465, timeout=20)
-        s.login(SENDER_EMAIL, SENDER_PASSWORD)
-        s.send_message(msg)
-        s.quit()
+        with _smtp_lock:
+            s = _get_smtp()
+            s.send_message(msg)
         return True, "sent"
     except Exception as e:
         return False, str(e)
 
-# ---- Routes ----
-@app.route("/")
-def index():
+# ---- UI page, loaded once at import (restart the server after editing it) ----
+def _load_index():
     # Serve whichever filename you have locally
     here = os.path.dirname(os.path.abspath(__file__))
     for name in ("dosemate_pump1.html", "dosemate_pump1 (2).html"):
         p = os.path.join(here, name)
         if os.path.exists(p):
-            return open(p, "r", encoding="utf-8").read()
-    return "<h2>⚠️ Put dosemate_pump1.html next to app.py</h2>"
+            with open(p, "rb") as f:
+                return f.read()
+    return None
+
+# Raw UTF-8 bytes straight from disk: no decode/encode round-trip per response
+_INDEX_BYTES = _load_index()
+_INDEX_MISSING = "<h2>⚠️ Put dosemate_pump1.html next to app.py</h2>".encode("utf-8")
+_HTML_TYPE = "text/html; charset=utf-8"
+if _INDEX_BYTES is not None:
+    _INDEX_GZ   = gzip.compress(_INDEX_BYTES, 9)
+    _INDEX_ETAG = '"%s"' % hashlib.md5(_INDEX_BYTES).hexdigest()
+
+# ---- Routes ----
+@app.route("/")
+def index():
+    if _INDEX_BYTES is None:
+        return Response(_INDEX_MISSING, content_type=_HTML_TYPE)
+    headers = {"ETag": _INDEX_ETAG, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+    if _INDEX_ETAG in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(_INDEX_GZ, content_type=_HTML_TYPE, headers=headers)
+    return Response(_INDEX_BYTES, content_type=_HTML_TYPE, headers=headers)
 
 @app.route("/api/system_time")
 def api_system_time():
@@ -411,9 +953,21 @@ def api_start_infusion():
 
     if HARDWARE_AVAILABLE:
         _gpio_setup()
+    prev = infusion_state["thread"]
+    if prev is not None and _cancel_evt.is_set():
+        # A cancelled worker wakes at once; give it a moment to finish rather
+        # than refusing a start issued right after the cancel
+        prev.join(timeout=0.5)
     with infusion_state["lock"]:
-        if infusion_state["running"]:
+        prev = infusion_state["thread"]
+        # A cancelled worker may still be stopping; don't let it run alongside a new one
+        if infusion_state_ref[0].running or (prev is not None and prev.is_alive()):
             return jsonify({"status":"error","message":"Already running"}), 400
+        _resume_evt.set()
+        _cancel_evt.clear()
+        infusion_state_ref[0] = infusion_state_ref[0]._replace(
+            running=True, paused=False, cancelled=False, steps_done=0,
+            progress_pct=0.0, eta_h=0, eta_m=0, eta_s=0)
         t = threading.Thread(target=infusion_worker, args=(flow, vol, syr), daemon=True)
         infusion_state["thread"] = t
         t.start()
@@ -421,56 +975,40 @@ def api_start_infusion():
 
 @app.route("/api/pause_infusion", methods=["POST"])
 def api_pause_infusion():
+    # Check, event and snapshot under one lock so the worker's finish
+    # cannot slip in between
     with infusion_state["lock"]:
-        if infusion_state["running"]:
-            infusion_state["paused"] = True
+        if infusion_state_ref[0].running:
+            _resume_evt.clear()
+            infusion_state_ref[0] = infusion_state_ref[0]._replace(paused=True)
     return jsonify({"status":"paused"})
 
 @app.route("/api/resume_infusion", methods=["POST"])
 def api_resume_infusion():
     with infusion_state["lock"]:
-        if infusion_state["running"]:
-            infusion_state["paused"] = False
+        if infusion_state_ref[0].running:
+            _resume_evt.set()
+            infusion_state_ref[0] = infusion_state_ref[0]._replace(paused=False)
     return jsonify({"status":"resumed"})
 
 @app.route("/api/cancel_infusion", methods=["POST"])
 def api_cancel_infusion():
     with infusion_state["lock"]:
-        infusion_state["cancelled"] = True
-        infusion_state["running"] = False
-        infusion_state["paused"]  = False
+        _cancel_evt.set()
+        _resume_evt.set()  # wake a paused worker so it sees the cancel
+        infusion_state_ref[0] = infusion_state_ref[0]._replace(
+            cancelled=True, running=False, paused=False)
     _gpio_disable()
     return jsonify({"status":"cancelled"})
 
 @app.route("/api/infusion_status")
 def api_infusion_status():
-    with infusion_state["lock"]:
-        running = infusion_state["running"]
-        paused = infusion_state["paused"]
-        cancelled = infusion_state["cancelled"]
-        total_steps = infusion_state["total_steps"]
-        steps_done  = infusion_state["steps_done"]
-        sps = infusion_state["steps_per_sec"]
-    progress = (steps_done/total_steps*100.0) if total_steps>0 else 0.0
-    rem = max(total_steps - steps_done, 0)
-    eta = (rem/sps) if sps>0 else 0
-    return jsonify({
-        "running": running,
-        "paused": paused,
-        "cancelled": cancelled,
-        "progress_pct": progress,
-        "steps_done": steps_done,
-        "total_steps": total_steps,
-        "eta_h": int(eta//3600),
-        "eta_m": int((eta%3600)//60),
-        "eta_s": int(eta%60)
-    })
+    return jsonify(infusion_state_ref[0]._asdict())
 
 @app.route("/api/reset_plunger", methods=["POST"])
 def api_reset_plunger():
-    with infusion_state["lock"]:
-        if infusion_state["running"]:
-            return jsonify({"status":"error","message":"Infusion running"}), 400
+    if infusion_state_ref[0].running:
+        return jsonify({"status":"error","message":"Infusion running"}), 400
     if HARDWARE_AVAILABLE:
         _gpio_setup()
     threading.Thread(target=retract_worker, daemon=True).start()
@@ -479,54 +1017,87 @@ def api_reset_plunger():
 @app.route("/api/save_record", methods=["POST"])
 def api_save_record():
     try:
-        rec = request.json
-        data = []
-        if os.path.exists('infusion_records.json'):
-            try:
-                data = json.load(open('infusion_records.json','r'))
-            except Exception:
-                data = []
-        data.append(rec)
-        json.dump(data, open('infusion_records.json','w'), indent=2)
+        _append_record(request.json)
         return jsonify({"status":"success"})
     except Exception as e:
         return jsonify({"status":"error","message":str(e)}), 400
 
 @app.route("/api/load_records")
 def api_load_records():
-    if os.path.exists('infusion_records.json'):
-        try:
-            data = json.load(open('infusion_records.json','r'))
-        except Exception:
-            data = []
-    else:
+    try:
+        data = list(_iter_records())
+    except Exception:
         data = []
     return jsonify(data)
 
-@app.route("/api/email_records", methods=["POST"])
-def api_email_records():
-    d = request.json or {}
-    to = (d.get('to') or '').strip()
-    kind = (d.get('kind') or 'csv').lower()
-    if not to:
-        return jsonify({'status':'error','message':'Recipient required'}), 400
+def _do_export_and_email(to, kind):
     try:
         attach = export_records_csv() if kind=='csv' else export_records_json()
     except Exception as e:
-        return jsonify({'status':'error','message':f'export failed: {e}'}), 400
+        return False, f'export failed: {e}'
     ok, msg = send_email_fixed(to, [attach])
     try:
         os.remove(attach)
     except Exception:
         pass
-    return (jsonify({'status':'ok'}) if ok else
-            (jsonify({'status':'error','message':msg}), 400))
+    return ok, msg
+
+# Export + SMTP run here so the request thread returns immediately; one
+# worker, so exports and sends still run one at a time
+_email_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='email')
+_email_jobs = {}      # job_id -> Future of _run_email_job
+_email_done_at = {}   # job_id -> monotonic time the job finished
+_EMAIL_JOB_TTL = 600  # s a finished job's result waits to be polled
+
+def _evict_email_jobs():
+    # Results nobody polled (page closed mid-send) would otherwise pile up
+    cutoff = time.monotonic() - _EMAIL_JOB_TTL
+    for jid, t in list(_email_done_at.items()):
+        if t < cutoff:
+            _email_jobs.pop(jid, None)
+            _email_done_at.pop(jid, None)
+
+def _run_email_job(jid, to, kind):
+    try:
+        return _do_export_and_email(to, kind)
+    finally:
+        _email_done_at[jid] = time.monotonic()
+
+@app.route("/api/email_records", methods=["POST"])
+def api_email_records():
+    d = request.json or {}
+    to = (d.get('to') or '').strip()
+    kind = (d.get('kind') or 'csv').lower()
+    if not to:
+        return jsonify({'status':'error','message':'Recipient required'}), 400
+    _evict_email_jobs()
+    jid = uuid.uuid4().hex
+    _email_jobs[jid] = _email_executor.submit(_run_email_job, jid, to, kind)
+    return jsonify({'status':'queued','job_id':jid}), 202
+
+@app.route("/api/email_status")
+def api_email_status():
+    jid = request.args.get('job_id', '')
+    fut = _email_jobs.get(jid)
+    if fut is None:
+        return jsonify({'status':'error','message':'Unknown job'}), 404
+    if not fut.done():
+        return jsonify({'status':'queued'})
+    _email_jobs.pop(jid, None)  # result is reported once
+    _email_done_at.pop(jid, None)
+    ok, msg = fut.result()
+    return jsonify({'status':'ok'} if ok else {'status':'error','message':msg})
 
 if __name__ == "__main__":
     print("""
 DoseMate Syringe Infusion Pump Server (Pi 5)
 UI: http://0.0.0.0:5000
-Run with:  sudo python3 app.py
+Run with:  sudo pigpiod && sudo python3 app.py   (Pi 5: sudo python3 app.py)
 Kiosk: chromium-browser --kiosk --app=http://localhost:5000 --window-size=800,480 --force-device-scale-factor=1
 """)
-    app.run(host="0.0.0.0", port=5000, debug=False)
+    _migrate_records_json()
+    # Move everything allocated at startup out of the GC's reach so
+    # collections during an infusion stay short
+    gc.freeze()
+    # threaded=True is the default; kept explicit as status polling relies on it
+    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)